@@ -0,0 +1,19 @@
+"""
+Gunicorn configuration for production
+
+Run with: gunicorn main:app -c gunicorn.conf.py
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Import the app once in the master; workers share it copy-on-write after fork.
+# Database and Stripe clients are created per worker in the app's startup hooks.
+preload_app = True
+
+timeout = 30
+graceful_timeout = 10
@@ -1,48 +1,104 @@
+import asyncio
+import logging
 import os
+import re
+import secrets
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, Body, FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from cachetools import TTLCache
+import orjson
+from pymongo.errors import PyMongoError
 
-from database import db, create_document, get_documents
-from schemas import Product, Order
+import database
+from database import create_document, create_documents
+from schemas import SLUG_PATTERN, Product, Order
 
 # Stripe
 import stripe
 
+log = logging.getLogger(__name__)
+
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+CACHE_FLUSH_TOKEN = os.getenv("CACHE_FLUSH_TOKEN")
+
+# Stripe redirect targets only depend on configuration
+_SUCCESS_URL = f"{FRONTEND_URL}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
+_CANCEL_URL = f"{FRONTEND_URL}/cart"
+
+STRIPE_TIMEOUT_SECONDS = 10
 
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Product catalog is read-heavy and rarely changes: keep recent reads in memory.
+# Keys are product slugs only; the pre-serialized full listing lives in its own
+# single-entry cache so it can never be served as a product.
+_PRODUCT_CACHE = TTLCache(maxsize=1024, ttl=60)
+_PRODUCT_LIST_CACHE = TTLCache(maxsize=1, ttl=60)
+# Recently requested slugs that don't exist, so repeated 404 probes skip Mongo
+_MISSING_SLUGS = TTLCache(maxsize=4096, ttl=60)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=[FRONTEND_URL],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    # Let browsers cache preflight responses for a day
+    max_age=86400,
 )
 
 
-class CartItem(BaseModel):
-    slug: str
-    quantity: int
-    size: Optional[str] = None
-    color: Optional[str] = None
+_ROOT_BYTES = orjson.dumps({"message": "Duck Tees API ready"})
 
 
-@app.get("/")
-def read_root():
-    return {"message": "Duck Tees API ready"}
+MAX_CART_ITEMS = 50
+
+
+_SLUG_RE = re.compile(SLUG_PATTERN)
+
+_NOT_FOUND_BYTES = orjson.dumps({"detail": "Product not found"})
+
+
+class CartItem(BaseModel):
+    slug: str = Field(..., pattern=SLUG_PATTERN)
+    quantity: int = Field(..., ge=1, le=999)
+    size: Optional[str] = Field(None, max_length=32)
+    color: Optional[str] = Field(None, max_length=64)
 
 
-# Seed some demo products if none exist
+@app.get("/")
+async def read_root():
+    return Response(content=_ROOT_BYTES, media_type="application/json")
+
+
+# Fields returned to clients for a single product
+_PRODUCT_PROJECTION = {
+    "_id": 1,
+    "title": 1,
+    "description": 1,
+    "price_cents": 1,
+    "currency": 1,
+    "category": 1,
+    "images": 1,
+    "colors": 1,
+    "sizes": 1,
+    "in_stock": 1,
+    "slug": 1,
+    "sku": 1,
+}
+
+
+# Seed some demo products if none exist (trusted literals, so validation is skipped)
 SEED_PRODUCTS = [
-    Product(
+    Product.model_construct(
         title="Happy Duck Tee",
         description="Weiches Bio-T-Shirt mit fröhlicher Enten-Illustration.",
         price_cents=2499,
@@ -56,7 +112,7 @@ SEED_PRODUCTS = [
         sizes=["S", "M", "L", "XL"],
         sku="DUCK-001",
     ),
-    Product(
+    Product.model_construct(
         title="Skater Duck Tee",
         description="Lässige Ente auf dem Skateboard – Style trifft Humor.",
         price_cents=2799,
@@ -70,7 +126,7 @@ SEED_PRODUCTS = [
         sizes=["S", "M", "L", "XL"],
         sku="DUCK-002",
     ),
-    Product(
+    Product.model_construct(
         title="Explorer Duck Tee",
         description="Abenteuerlustige Ente im Natur-Look.",
         price_cents=2999,
@@ -87,109 +143,237 @@ SEED_PRODUCTS = [
 ]
 
 
-def ensure_seed_products():
-    if db is None:
+@app.on_event("startup")
+async def connect_database():
+    database.connect_database()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    database.close_database()
+
+
+@app.on_event("startup")
+async def configure_stripe_client():
+    # One pooled async HTTP client for all Stripe calls, so connections and
+    # TLS sessions are reused across requests.
+    stripe.default_http_client = stripe.HTTPXClient()
+
+
+@app.on_event("shutdown")
+async def close_stripe_client():
+    if stripe.default_http_client is not None:
+        await stripe.default_http_client.close_async()
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if database.db is None:
         return
     try:
-        count = db["product"].count_documents({})
+        await database.db["product"].create_index("slug", unique=True)
+        await database.db["product"].create_index("sku", unique=True, sparse=True)
+    except PyMongoError as e:
+        log.warning("product index creation skipped: %s", e)
+
+
+@app.on_event("startup")
+async def ensure_seed_products():
+    if database.db is None:
+        return
+    try:
+        # Collection metadata is enough to tell whether the catalog is empty
+        count = await database.db["product"].estimated_document_count()
         if count == 0:
-            for p in SEED_PRODUCTS:
-                create_document("product", p)
-    except Exception:
-        pass
+            await create_documents("product", SEED_PRODUCTS)
+            _PRODUCT_CACHE.clear()
+            _PRODUCT_LIST_CACHE.clear()
+            _MISSING_SLUGS.clear()
+    except PyMongoError as e:
+        log.warning("product seed skipped: %s", e)
 
 
 @app.get("/api/products")
-def list_products():
-    ensure_seed_products()
-    products = get_documents("product")
-    # Convert ObjectId to string if present
-    for p in products:
-        if "_id" in p:
-            p["id"] = str(p.pop("_id"))
-    return {"products": products}
+async def list_products():
+    cached = _PRODUCT_LIST_CACHE.get("products")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    if database.db is None:
+        raise HTTPException(status_code=500, detail="Database not available")
+
+    # Pull the first document before committing to a 200, so connection and
+    # server-selection errors still surface as a proper error response.
+    cursor = database.db["product"].find({}, projection=_PRODUCT_PROJECTION)
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        first = None
+    except PyMongoError as e:
+        log.warning("product listing failed: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+
+    async def stream_products():
+        # Emit the listing one document at a time and keep the chunks so the
+        # complete body can be cached once the cursor is exhausted.
+        chunks = [b'{"products":[']
+        yield chunks[0]
+        if first is not None:
+            first["id"] = str(first.pop("_id"))
+            chunks.append(orjson.dumps(first))
+            yield chunks[-1]
+            async for p in cursor:
+                # Convert ObjectId to string
+                p["id"] = str(p.pop("_id"))
+                chunks.append(b"," + orjson.dumps(p))
+                yield chunks[-1]
+        chunks.append(b"]}")
+        yield chunks[-1]
+        _PRODUCT_LIST_CACHE["products"] = b"".join(chunks)
+
+    return StreamingResponse(stream_products(), media_type="application/json")
+
+
+@app.post("/api/products/_flush")
+async def flush_product_cache(x_cache_flush_token: Optional[str] = Header(None)):
+    """Clear the product caches of the worker process handling this request.
+
+    Requires the X-Cache-Flush-Token header to match CACHE_FLUSH_TOKEN; the
+    endpoint is disabled when that is unset. Other workers keep their entries
+    until their 60 s TTL expires or they are restarted.
+    """
+    if not CACHE_FLUSH_TOKEN or not x_cache_flush_token or not secrets.compare_digest(
+        x_cache_flush_token.encode(), CACHE_FLUSH_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    _PRODUCT_CACHE.clear()
+    _PRODUCT_LIST_CACHE.clear()
+    _MISSING_SLUGS.clear()
+    return {"flushed": True}
 
 
 @app.get("/api/products/{slug}")
-def get_product(slug: str):
-    prod = db["product"].find_one({"slug": slug}) if db else None
+async def get_product(slug: str):
+    # Slugs that can't exist, or were just looked up and missing, never reach
+    # the cache or Mongo
+    if not _SLUG_RE.fullmatch(slug) or slug in _MISSING_SLUGS:
+        return Response(content=_NOT_FOUND_BYTES, status_code=404, media_type="application/json")
+    cached = _PRODUCT_CACHE.get(slug)
+    if cached is not None:
+        return cached
+    prod = await database.db["product"].find_one({"slug": slug}, projection=_PRODUCT_PROJECTION) if database.db is not None else None
     if not prod:
-        raise HTTPException(status_code=404, detail="Product not found")
+        _MISSING_SLUGS[slug] = True
+        return Response(content=_NOT_FOUND_BYTES, status_code=404, media_type="application/json")
     prod["id"] = str(prod.pop("_id"))
+    _PRODUCT_CACHE[slug] = prod
     return prod
 
 
+async def save_pending_order(order: Order):
+    if database.db is None:
+        log.warning("pending order %s not saved: database not available", order.stripe_session_id)
+        return
+    try:
+        await create_document("order", order)
+    except PyMongoError:
+        log.exception("failed to save pending order %s", order.stripe_session_id)
+
+
 @app.post("/api/create-checkout-session")
-def create_checkout_session(items: List[CartItem]):
+async def create_checkout_session(
+    background: BackgroundTasks,
+    items: List[CartItem] = Body(..., min_length=1, max_length=MAX_CART_ITEMS),
+):
     if not STRIPE_SECRET_KEY:
         raise HTTPException(status_code=500, detail="Stripe not configured")
 
-    if not items:
-        raise HTTPException(status_code=400, detail="Cart is empty")
-
-    line_items = []
-    computed_total = 0
-    order_items = []
-
-    for item in items:
-        prod = db["product"].find_one({"slug": item.slug}) if db else None
-        if not prod:
-            raise HTTPException(status_code=404, detail=f"Product {item.slug} not found")
-        price_cents = int(prod.get("price_cents", 0))
-        qty = max(1, int(item.quantity))
-        computed_total += price_cents * qty
-        order_items.append({
+    # Fetch every product in the cart with a single round-trip
+    slugs = list({item.slug for item in items})
+    products = {}
+    if database.db is not None:
+        cursor = database.db["product"].find(
+            {"slug": {"$in": slugs}},
+            # Only the first image is sent to Stripe, so let Mongo trim the array
+            projection={
+                "slug": 1,
+                "title": 1,
+                "price_cents": 1,
+                "currency": 1,
+                "images": {"$slice": 1},
+            },
+        )
+        products = {p["slug"]: p async for p in cursor}
+
+    missing = next((item.slug for item in items if item.slug not in products), None)
+    if missing is not None:
+        raise HTTPException(status_code=404, detail=f"Product {missing} not found")
+
+    rows = [(item, products[item.slug]) for item in items]
+    order_items = [
+        {
             "slug": item.slug,
             "title": prod.get("title"),
-            "quantity": qty,
-            "price_cents": price_cents,
+            "quantity": item.quantity,
+            "price_cents": int(prod.get("price_cents", 0)),
             "size": item.size,
             "color": item.color,
-        })
-        line_items.append({
-            "quantity": qty,
+        }
+        for item, prod in rows
+    ]
+    line_items = [
+        {
+            "quantity": order_item["quantity"],
             "price_data": {
                 "currency": prod.get("currency", "eur"),
-                "unit_amount": price_cents,
+                "unit_amount": order_item["price_cents"],
                 "product_data": {
-                    "name": prod.get("title", "Duck Tee"),
-                    "images": prod.get("images", [])[:1],
+                    "name": order_item["title"] or "Duck Tee",
+                    "images": prod.get("images", []),
                 },
             },
-        })
+        }
+        for order_item, (_, prod) in zip(order_items, rows)
+    ]
+    computed_total = sum(o["quantity"] * o["price_cents"] for o in order_items)
 
     try:
-        session = stripe.checkout.Session.create(
-            mode="payment",
-            payment_method_types=["card"],
-            line_items=line_items,
-            success_url=f"{FRONTEND_URL}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{FRONTEND_URL}/cart",
+        session = await asyncio.wait_for(
+            stripe.checkout.Session.create_async(
+                mode="payment",
+                payment_method_types=["card"],
+                line_items=line_items,
+                success_url=_SUCCESS_URL,
+                cancel_url=_CANCEL_URL,
+            ),
+            timeout=STRIPE_TIMEOUT_SECONDS,
         )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Stripe request timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    # store order as pending
-    try:
-        create_document("order", Order(
-            email="unknown",
-            items=order_items,
-            amount_total=computed_total,
-            currency="eur",
-            stripe_session_id=session.id,
-        ))
-    except Exception:
-        pass
+    # store order as pending once the response is sent; every field is
+    # server-computed, so skip validation
+    background.add_task(save_pending_order, Order.model_construct(
+        email="unknown",
+        items=order_items,
+        amount_total=computed_total,
+        currency="eur",
+        stripe_session_id=session.id,
+    ))
 
     return {"id": session.id, "url": session.url}
 
 
 @app.get("/api/stripe/session/{session_id}")
-def get_session_status(session_id: str):
+async def get_session_status(session_id: str):
     if not STRIPE_SECRET_KEY:
         raise HTTPException(status_code=500, detail="Stripe not configured")
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
+        session = await asyncio.wait_for(
+            stripe.checkout.Session.retrieve_async(session_id),
+            timeout=STRIPE_TIMEOUT_SECONDS,
+        )
         return {
             "id": session.id,
             "payment_status": session.payment_status,
@@ -197,12 +381,33 @@ def get_session_status(session_id: str):
             "amount_total": session.amount_total,
             "currency": session.currency,
         }
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Stripe request timed out")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+_HEALTH_OK = orjson.dumps({"ok": True})
+
+# Collection names only change on deploys/seeding; don't hit Mongo on every /test
+_COLLECTIONS_CACHE = TTLCache(maxsize=1, ttl=30)
+
+
+@app.get("/healthz")
+async def health():
+    return Response(content=_HEALTH_OK, media_type="application/json")
+
+
+async def list_collection_names():
+    collections = _COLLECTIONS_CACHE.get("names")
+    if collections is None:
+        collections = await database.db.list_collection_names()
+        _COLLECTIONS_CACHE["names"] = collections
+    return collections
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -211,25 +416,29 @@ def test_database():
         "connection_status": "Not Connected",
         "collections": []
     }
-    try:
-        from database import db as _db
-        if _db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = _db.name if hasattr(_db, 'name') else "✅ Connected"
-            response["connection_status"] = "Connected"
-            try:
-                collections = _db.list_collection_names()
-                response["collections"] = collections[:10]
-                response["database"] = "✅ Connected & Working"
-            except Exception as e:
-                response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
-    except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
+    if database.db is not None:
+        response["database"] = "✅ Available"
+        response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+        response["database_name"] = database.db.name if hasattr(database.db, 'name') else "✅ Connected"
+        response["connection_status"] = "Connected"
+        try:
+            collections = await list_collection_names()
+            response["collections"] = collections[:10]
+            response["database"] = "✅ Connected & Working"
+        except Exception as e:
+            response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
     return response
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
@@ -14,6 +14,9 @@ Model name is converted to lowercase for the collection name:
 from pydantic import BaseModel, Field
 from typing import Optional, List
 
+# URL-friendly product identifier; shared by request validation in main.py
+SLUG_PATTERN = r"^[a-z0-9-]{1,64}$"
+
 class User(BaseModel):
     """
     Users collection schema
@@ -36,10 +39,10 @@ class Product(BaseModel):
     currency: str = Field("eur", description="ISO currency code")
     category: str = Field("T-Shirts", description="Product category")
     in_stock: bool = Field(True, description="Whether product is in stock")
-    slug: str = Field(..., description="URL-friendly unique identifier")
-    images: List[str] = Field(default_factory=list, description="Image URLs")
-    colors: List[str] = Field(default_factory=list, description="Available colors")
-    sizes: List[str] = Field(default_factory=lambda: ["S","M","L","XL"], description="Available sizes")
+    slug: str = Field(..., pattern=SLUG_PATTERN, description="URL-friendly unique identifier")
+    images: List[str] = Field(default_factory=list, max_length=20, description="Image URLs")
+    colors: List[str] = Field(default_factory=list, max_length=20, description="Available colors")
+    sizes: List[str] = Field(default_factory=lambda: ["S","M","L","XL"], max_length=20, description="Available sizes")
     sku: Optional[str] = Field(None, description="Stock keeping unit")
 
 class Order(BaseModel):